@@ -1,9 +1,19 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import bottleneck as bn
+import httpx
+import orjson
 import requests
+import threading
 import time
+import websocket
+from requests.adapters import HTTPAdapter
 import plotly.graph_objects as go
+from cachetools import TTLCache
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 
 # =========================
@@ -11,10 +21,16 @@ from datetime import datetime, timedelta
 # =========================
 BINANCE_API = "https://api.binance.us/api/v3/klines"
 OKX_API = "https://www.okx.com/api/v5/market/candles"
+BINANCE_WS = "wss://stream.binance.us:9443/stream"
+STREAM_STALE_SEC = 30  # 超過此秒數沒收到推送就改回 REST
 INTERVAL = "1m"
 LIMIT = 120
 MIN_BARS = 60
 
+# Binance IP 權重上限 1200/分鐘，保留餘裕
+BINANCE_WEIGHT_PER_MIN = 1000
+BINANCE_WEIGHT_BACKOFF = 900  # X-MBX-USED-WEIGHT-1M 超過即暫停到下一分鐘
+
 TG_BOT_TOKEN = st.secrets.get("TG_BOT_TOKEN", "")
 TG_CHAT_ID = st.secrets.get("TG_CHAT_ID", "")
 
@@ -28,12 +44,19 @@ GRID_PARAMS = {
 # =========================
 # 工具函式
 # =========================
-def send_telegram(msg):
-    if not TG_BOT_TOKEN or not TG_CHAT_ID:
-        return
+@st.cache_resource
+def get_telegram_sender():
+    """Telegram 背景發送：單執行緒佇列 + keep-alive Session，不阻塞畫面刷新"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=2))
+    session.headers["Keep-Alive"] = "timeout=75"
+    return ThreadPoolExecutor(max_workers=1), session
+
+
+def post_telegram(session, msg):
     try:
         url = f"https://api.telegram.org/bot{TG_BOT_TOKEN}/sendMessage"
-        requests.post(
+        session.post(
             url,
             data={"chat_id": TG_CHAT_ID, "text": msg},
             timeout=5
@@ -42,34 +65,101 @@ def send_telegram(msg):
         pass
 
 
-def get_klines_binance(symbol):
+def send_telegram(msg):
+    """排入背景佇列後立即返回"""
+    if not TG_BOT_TOKEN or not TG_CHAT_ID:
+        return
+    executor, session = get_telegram_sender()
+    executor.submit(post_telegram, session, msg)
+
+
+def klines_frame(rows):
+    """K 線原始列 → DataFrame：逐欄直接建成 float64，不經 object 欄位再 astype"""
+    cols = list(zip(*rows))
+    # 毫秒時間戳直接 view 成 datetime64，不經 pd.to_datetime 逐筆轉換
+    frame = {"open_time": np.asarray(cols[0], dtype=np.int64).view("datetime64[ms]")}
+    for i, name in enumerate(["open", "high", "low", "close", "volume"], start=1):
+        frame[name] = np.asarray(cols[i], dtype=np.float64)
+    return pd.DataFrame(frame)
+
+
+def make_session():
+    """行情 Client：HTTP/2 讓所有幣種的請求共用同一條 TCP+TLS 連線多工傳輸"""
+    return httpx.Client(
+        http2=True,
+        timeout=5.0,
+        limits=httpx.Limits(max_keepalive_connections=10)
+    )
+
+
+class RateLimiter:
+    """Binance 權重 token bucket，所有 session 與抓取執行緒共用"""
+
+    def __init__(self, rate, per=60.0):
+        self.lock = threading.Lock()
+        self.capacity = rate
+        self.tokens = rate
+        self.fill_rate = rate / per
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+
+    def acquire(self, weight=1):
+        """取得權重額度，不足時等待補充"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.stamp) * self.fill_rate
+                )
+                self.stamp = now
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = (weight - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+    def update(self, r):
+        """依回應退避：418/429 照 Retry-After，已用權重過高則等到下一分鐘"""
+        now = time.time()
+        if r.status_code in (418, 429):
+            self.blocked_until = now + float(r.headers.get("Retry-After", 60))
+        elif int(r.headers.get("X-MBX-USED-WEIGHT-1M", 0)) > BINANCE_WEIGHT_BACKOFF:
+            self.blocked_until = now + 60 - now % 60
+
+    def blocked(self):
+        return time.time() < self.blocked_until
+
+
+@st.cache_resource
+def get_rate_limiter():
+    return RateLimiter(BINANCE_WEIGHT_PER_MIN)
+
+
+def get_klines_binance(symbol, session, limit=LIMIT):
+    limiter = get_rate_limiter()
+    if limiter.blocked():
+        return None  # 退避中，交給 OKX 備援
+
     try:
         params = {
             "symbol": symbol,
             "interval": INTERVAL,
-            "limit": LIMIT
+            "limit": limit
         }
-        r = requests.get(BINANCE_API, params=params, timeout=10)
-        data = r.json()
+        limiter.acquire()
+        r = session.get(BINANCE_API, params=params)
+        limiter.update(r)
+        data = orjson.loads(r.content)
         if not isinstance(data, list) or len(data) == 0:
             return None
 
-        df = pd.DataFrame(data, columns=[
-            "open_time", "open", "high", "low", "close", "volume",
-            "close_time", "qav", "trades",
-            "taker_base", "taker_quote", "ignore"
-        ])
-
-        df["open_time"] = pd.to_datetime(df["open_time"], unit="ms")
-        df[["open", "high", "low", "close", "volume"]] = \
-            df[["open", "high", "low", "close", "volume"]].astype(float)
-
-        return df
+        return klines_frame(data)
     except:
         return None
 
 
-def get_klines_okx(symbol):
+def get_klines_okx(symbol, session, limit=LIMIT):
     """備援：OKX 行情"""
     try:
         # 轉換 symbol：BTCUSDT -> BTC-USDT
@@ -77,76 +167,303 @@ def get_klines_okx(symbol):
         params = {
             "instId": okx_symbol,
             "bar": "1m",
-            "limit": LIMIT
+            "limit": limit
         }
-        r = requests.get(OKX_API, params=params, timeout=10)
-        data = r.json()
+        r = session.get(OKX_API, params=params)
+        data = orjson.loads(r.content)
         if data.get("code") != "0" or not data.get("data"):
             return None
 
-        candles = data["data"]
-        df = pd.DataFrame(candles, columns=[
-            "open_time", "open", "high", "low", "close", "volume", "extra"
-        ])
-
-        df["open_time"] = pd.to_datetime(df["open_time"].astype(int), unit="ms")
-        df[["open", "high", "low", "close", "volume"]] = \
-            df[["open", "high", "low", "close", "volume"]].astype(float)
-
-        return df.sort_values("open_time").reset_index(drop=True)
+        # OKX 由新到舊排列，反轉成時間順序
+        return klines_frame(data["data"][::-1])
     except:
         return None
 
 
-def get_klines(symbol):
+def get_klines(symbol, session):
     """主要行情源 + 自動備援"""
-    df = get_klines_binance(symbol)
+    df = get_klines_binance(symbol, session)
     if df is not None and len(df) > 0:
         return df, "Binance"
 
-    df = get_klines_okx(symbol)
+    df = get_klines_okx(symbol, session)
     if df is not None and len(df) > 0:
         return df, "OKX"
 
     return None, None
 
 
-def add_indicators(df):
-    df = df.copy()
-    df["ma20"] = df["close"].rolling(20).mean()
-    df["ma60"] = df["close"].rolling(60).mean()
-    df["ma120"] = df["close"].rolling(120).mean()
-    df["vol_ma20"] = df["volume"].rolling(20).mean()
-    df["pct"] = df["close"].pct_change() * 100
-
-    # ATR 計算
-    df["tr"] = np.maximum(
-        df["high"] - df["low"],
-        np.maximum(
-            abs(df["high"] - df["close"].shift(1)),
-            abs(df["low"] - df["close"].shift(1))
-        )
-    )
-    df["atr"] = df["tr"].rolling(14).mean()
-    df["atr_pct"] = (df["atr"] / df["close"]) * 100
+class KlinesUnavailable(Exception):
+    """所有行情源都抓不到；用例外讓 st.cache_data 不快取失敗結果"""
+
+
+@st.cache_data(ttl=55, show_spinner=False)
+def get_klines_cached(symbol, minute_bucket, _session):
+    """整段 K 線快取：minute_bucket 換分鐘即失效，同一分鐘內直接讀記憶體"""
+    df, source = get_klines(symbol, _session)
+    if df is None:
+        raise KlinesUnavailable(symbol)
+    return df, source
+
 
-    return df
+def splice_klines(df, tail):
+    """用最新幾根 K 棒覆蓋快取的尾端"""
+    if tail is None or len(tail) == 0:
+        return df
+    head = df[df["open_time"] < tail["open_time"].iloc[0]]
+    df = pd.concat([head, tail], ignore_index=True)
+    return df.tail(LIMIT).reset_index(drop=True)
+
+
+def get_klines_live(symbol, session):
+    """快取整段 + 只抓最新 2 根拼接，更新進行中的 K 棒"""
+    try:
+        df, source = get_klines_cached(symbol, int(time.time() // 60), session)
+    except KlinesUnavailable:
+        return None, None  # 下次刷新重試
+
+    fetch = get_klines_binance if source == "Binance" else get_klines_okx
+    tail = fetch(symbol, session, limit=2)
+    return splice_klines(df, tail), source
+
+
+class KlineStream:
+    """Binance 1m K 線 WebSocket：背景執行緒接收推送，每個幣種保留最近 LIMIT 根"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buffers = {}
+        self.updated = {}
+        self.symbols = set()
+        self.ws = None
+
+    def ensure(self, symbols):
+        """首次呼叫時連線，之後只訂閱新增的幣種（多個 session 可能同時呼叫）"""
+        with self.lock:
+            new = list(set(symbols) - self.symbols)
+            self.symbols.update(new)
+            connect = self.ws is None
+            if connect:
+                self.ws = websocket.WebSocketApp(
+                    BINANCE_WS,
+                    on_open=self._on_open,
+                    on_message=self._on_message
+                )
+
+        if connect:
+            threading.Thread(
+                target=self.ws.run_forever,
+                kwargs={"reconnect": 5},
+                daemon=True
+            ).start()
+        elif new:
+            self._subscribe(new)
+
+    def _on_open(self, ws):
+        # 連線 / 重連後訂閱全部；取快照，避免迭代時被其他執行緒修改
+        with self.lock:
+            symbols = list(self.symbols)
+        self._subscribe(symbols)
+
+    def _subscribe(self, symbols):
+        try:
+            self.ws.send(orjson.dumps({
+                "method": "SUBSCRIBE",
+                "params": [f"{s.lower()}@kline_{INTERVAL}" for s in symbols],
+                "id": int(time.time())
+            }))
+        except:
+            pass  # 尚未連上，on_open 會訂閱全部
+
+    def _on_message(self, ws, message):
+        data = orjson.loads(message).get("data")
+        if not data or "k" not in data:
+            return
+
+        k = data["k"]
+        bar = (k["t"], float(k["o"]), float(k["h"]), float(k["l"]),
+               float(k["c"]), float(k["v"]))
+        with self.lock:
+            buf = self.buffers.get(k["s"])
+            if not buf:
+                return  # 等 REST 回補
+            if bar[0] == buf[-1][0]:
+                buf[-1] = bar
+            elif bar[0] == buf[-1][0] + 60_000:
+                buf.append(bar)
+            elif bar[0] > buf[-1][0]:
+                # 斷線漏掉 K 棒，丟棄緩衝區重新回補
+                del self.buffers[k["s"]]
+                return
+            self.updated[k["s"]] = time.time()
+
+    def seed(self, symbol, df):
+        """REST 回補整段歷史；收到第一筆推送後 snapshot 才開始回傳"""
+        times = df["open_time"].to_numpy().astype("datetime64[ms]").astype(np.int64)
+        rows = zip(times.tolist(), *(df[c].tolist() for c in ["open", "high", "low", "close", "volume"]))
+        with self.lock:
+            self.buffers[symbol] = deque(rows, maxlen=LIMIT)
+
+    def snapshot(self, symbol):
+        """串流中的 K 線；資料不足或推送中斷時回傳 None"""
+        with self.lock:
+            buf = self.buffers.get(symbol)
+            if not buf or len(buf) < MIN_BARS:
+                return None
+            if time.time() - self.updated.get(symbol, 0) > STREAM_STALE_SEC:
+                return None
+            rows = list(buf)
+        return klines_frame(rows)
+
+
+@st.cache_resource
+def get_kline_stream():
+    """全部 session 共用一條 WebSocket 連線"""
+    return KlineStream()
+
+
+def fetch_all(symbols, session, stream):
+    """串流有資料直接用；其餘並行 REST 抓取（N×RTT → 約 1×RTT），Binance 結果回補串流"""
+    klines = {}
+    missing = []
+    for symbol in symbols:
+        df = stream.snapshot(symbol)
+        if df is not None:
+            klines[symbol] = (df, "Binance WS")
+        else:
+            missing.append(symbol)
+
+    if not missing:
+        return klines
+    with ThreadPoolExecutor(max_workers=len(missing)) as ex:
+        results = ex.map(lambda s: get_klines_live(s, session), missing)
+        for symbol, (df, source) in zip(missing, results):
+            if source == "Binance":
+                stream.seed(symbol, df)
+            klines[symbol] = (df, source)
+    return klines
+
+
+# 滑動平均欄位：(來源欄位, 窗口)
+ROLLING_WINDOWS = {
+    "ma20": ("close", 20),
+    "ma60": ("close", 60),
+    "vol_ma20": ("volume", 20),
+    "atr": ("tr", 14),
+}
+
+
+def sliding_mean(values, out, start, window):
+    """滑動和遞推 V[t] = V[t-1] + (S[t] - S[t-w]) / w，只補算 start 之後的 K 棒"""
+    for t in range(start, len(values)):
+        if t < window - 1:
+            out[t] = np.nan
+        elif t >= window and not np.isnan(out[t - 1]):
+            out[t] = out[t - 1] + (values[t] - values[t - window]) / window
+        else:
+            out[t] = values[t - window + 1:t + 1].mean()
+    return out
+
+
+@dataclass
+class SymbolState:
+    """單一幣種的 K 線與指標，每個欄位一條 NumPy 陣列（struct-of-arrays）"""
+    source: str
+    open_time: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    pct: np.ndarray
+    tr: np.ndarray
+    ma20: np.ndarray
+    ma60: np.ndarray
+    vol_ma20: np.ndarray
+    atr: np.ndarray
+    atr_pct: np.ndarray
+
+    def __len__(self):
+        return len(self.close)
+
+
+def add_indicators(df, source, prev=None):
+    """K 線 → SymbolState；prev：該幣種上一輪的狀態，只有新 K 棒需要重算均線"""
+    # REST 與 WebSocket 都是 Binance 報價，可以沿用同一份均線
+    source = "Binance" if source.startswith("Binance") else source
+    times = df["open_time"].to_numpy()
+    high = df["high"].to_numpy()
+    low = df["low"].to_numpy()
+    close = df["close"].to_numpy()
+    volume = df["volume"].to_numpy()
+
+    pct = np.empty_like(close)
+    pct[0] = np.nan
+    pct[1:] = (close[1:] / close[:-1] - 1) * 100
+
+    # ATR 計算：直接在 NumPy 陣列上一次取三者最大值
+    prev_close = np.empty_like(close)
+    prev_close[0] = np.nan
+    prev_close[1:] = close[:-1]
+    tr = np.maximum.reduce([
+        high - low,
+        np.abs(high - prev_close),
+        np.abs(low - prev_close)
+    ])
+
+    # 對齊上一輪狀態：最後一根可能尚未收盤，從它開始重算
+    # 換資料源時價量基準不同，舊均線不能沿用
+    start, offset = 0, 0
+    if prev is not None and prev.source == source:
+        start = int(np.searchsorted(times, prev.open_time[-1]))
+        offset = int(np.searchsorted(prev.open_time, times[0]))
+        if start >= len(times) or not np.array_equal(
+            prev.open_time[offset:offset + start], times[:start]
+        ):
+            start = 0
+
+    sources = {"close": close, "volume": volume, "tr": tr}
+    means = {}
+    for name, (column, window) in ROLLING_WINDOWS.items():
+        if start == 0:
+            means[name] = bn.move_mean(sources[column], window)
+            continue
+        out = np.empty(len(times))
+        out[:start] = getattr(prev, name)[offset:offset + start]
+        means[name] = sliding_mean(sources[column], out, start, window)
+
+    return SymbolState(
+        source=source,
+        open_time=times,
+        open=df["open"].to_numpy(),
+        high=high,
+        low=low,
+        close=close,
+        volume=volume,
+        pct=pct,
+        tr=tr,
+        atr_pct=means["atr"] / close * 100,
+        **means
+    )
 
 
 # =========================
 # 市場狀態判斷
 # =========================
-def market_state(df):
+def market_state(state):
     """判斷趨勢 / 盤整 / 風險"""
-    if df is None or len(df) < MIN_BARS:
+    if state is None or len(state) < MIN_BARS:
         return "待命", None
 
-    latest = df.iloc[-1]
+    close, ma20, ma60 = state.close[-1], state.ma20[-1], state.ma60[-1]
+
+    # MA120 只用最新一個值：直接對最後 120 根取平均，不建整欄
+    ma120 = state.close[-120:].mean() if len(state) >= 120 else np.nan
 
     # 趨勢判斷
-    if latest["close"] > latest["ma20"] > latest["ma60"] > latest["ma120"]:
+    if close > ma20 > ma60 > ma120:
         return "📈 上升趨勢", "UPTREND"
-    elif latest["close"] < latest["ma20"] < latest["ma60"] < latest["ma120"]:
+    elif close < ma20 < ma60 < ma120:
         return "📉 下降趨勢", "DOWNTREND"
     else:
         return "📊 盤整區", "RANGE"
@@ -155,18 +472,23 @@ def market_state(df):
 # =========================
 # Grid 建議計算
 # =========================
-def calculate_grid(symbol, df):
+GridInfo = namedtuple(
+    "GridInfo",
+    ["current", "lower", "upper", "grid_count", "grid_width", "atr_pct"]
+)
+
+
+def calculate_grid(symbol, state):
     """計算網格上下界 + 建議參數"""
-    if df is None or len(df) < 20:
+    if state is None or len(state) < 20:
         return None
 
-    latest = df.iloc[-1]
-    current_price = latest["close"]
-    atr_pct = latest["atr_pct"]
-
     if symbol not in GRID_PARAMS:
         return None
 
+    current_price = float(state.close[-1])
+    atr_pct = float(state.atr_pct[-1])
+
     params = GRID_PARAMS[symbol]
     lower_pct = params["lower_pct"]
     upper_pct = params["upper_pct"]
@@ -182,46 +504,47 @@ def calculate_grid(symbol, df):
 
     grid_width = (upper_price - lower_price) / grid_count
 
-    return {
-        "current": current_price,
-        "lower": lower_price,
-        "upper": upper_price,
-        "grid_count": grid_count,
-        "grid_width": grid_width,
-        "atr_pct": atr_pct
-    }
+    return GridInfo(
+        current=current_price,
+        lower=lower_price,
+        upper=upper_price,
+        grid_count=grid_count,
+        grid_width=grid_width,
+        atr_pct=atr_pct
+    )
 
 
 # =========================
 # Sniper 訊號（v2）
 # =========================
-def sniper_signal(df):
-    if df is None or len(df) < MIN_BARS:
+def sniper_signal(state):
+    if state is None or len(state) < MIN_BARS:
         return False, False, False
 
-    latest = df.iloc[-1]
+    close, ma20, ma60 = state.close[-1], state.ma20[-1], state.ma60[-1]
+    volume, vol_ma20, pct = state.volume[-1], state.vol_ma20[-1], state.pct[-1]
 
-    if pd.isna(latest["ma20"]) or pd.isna(latest["ma60"]):
+    if np.isnan(ma20) or np.isnan(ma60):
         return False, False, False
 
     # 🔥 攻擊：放量 + 突破 + 價強
     attack = (
-        latest["close"] > latest["ma20"] > latest["ma60"] and
-        latest["volume"] > latest["vol_ma20"] * 2 and
-        latest["pct"] > 0.8
+        close > ma20 > ma60 and
+        volume > vol_ma20 * 2 and
+        pct > 0.8
     )
 
     # 💣 伏擊：爆量但價格未動
     ambush = (
-        latest["volume"] > latest["vol_ma20"] * 3 and
-        abs(latest["pct"]) < 0.3
+        volume > vol_ma20 * 3 and
+        abs(pct) < 0.3
     )
 
     # 💀 出貨：跌破 + 爆量
     dump = (
-        latest["close"] < latest["ma20"] and
-        latest["volume"] > latest["vol_ma20"] * 2 and
-        latest["pct"] < -1
+        close < ma20 and
+        volume > vol_ma20 * 2 and
+        pct < -1
     )
 
     return attack, ambush, dump
@@ -230,15 +553,16 @@ def sniper_signal(df):
 # =========================
 # 風險雷達
 # =========================
-def risk_radar(df, symbol):
+def risk_radar(state, symbol):
     """檢測急拉急殺"""
-    if df is None or len(df) < 5:
+    if state is None or len(state) < 5:
         return None
 
-    recent = df.tail(5)
-    max_pct = recent["pct"].max()
-    min_pct = recent["pct"].min()
-    vol_spike = recent["volume"].iloc[-1] / recent["volume"].mean()
+    pct = state.pct[-5:]
+    volume = state.volume[-5:]
+    max_pct = np.nanmax(pct)
+    min_pct = np.nanmin(pct)
+    vol_spike = volume[-1] / volume.mean()
 
     alerts = []
 
@@ -254,6 +578,24 @@ def risk_radar(df, symbol):
     return alerts if alerts else None
 
 
+# =========================
+# K 線圖表
+# =========================
+def build_chart(symbol):
+    """圖表骨架：價格 + MA20 + MA60，資料每次刷新原地更新"""
+    fig = go.Figure()
+    fig.add_trace(go.Candlestick(name="Price"))
+    fig.add_trace(go.Scattergl(name="MA20", line=dict(color="blue")))
+    fig.add_trace(go.Scattergl(name="MA60", line=dict(color="orange")))
+    fig.update_layout(
+        height=400,
+        margin=dict(l=10, r=10, t=30, b=10),
+        xaxis_rangeslider_visible=False,
+        uirevision=symbol  # 重繪時保留使用者的縮放 / 平移
+    )
+    return fig
+
+
 # =========================
 # Streamlit UI
 # =========================
@@ -285,167 +627,176 @@ ETHUSDT: ±2.0% × ATR
 SOLUSDT: ±3.0% × ATR
 """)
 
-# 防止重複通知
+# 防止重複通知：同一訊號 1 小時內只發一次，過期自動清除
 if "alert_log" not in st.session_state:
-    st.session_state.alert_log = {}
+    st.session_state.alert_log = TTLCache(maxsize=1024, ttl=3600)
 
-# 主顯示區
-cols = st.columns(len(symbols))
+# 各幣種最新的 SymbolState，下一輪只增量計算新 K 棒
+if "symbol_states" not in st.session_state:
+    st.session_state.symbol_states = {}
 
-for col, symbol in zip(cols, symbols):
-    with col:
-        st.subheader(symbol)
+# 共用行情 Client：keep-alive，TCP/TLS 握手跨刷新重用
+if "http" not in st.session_state:
+    st.session_state.http = make_session()
 
-        df, source = get_klines(symbol)
 
-        if df is None or len(df) < MIN_BARS:
-            st.warning(f"⏳ 等待 K 線資料 ({source or '所有源'})")
-            continue
+def render_symbol(symbol, df, source):
+    """單一幣種面板：狀態 / Grid / 訊號 / 風險 / K 線圖"""
+    st.subheader(symbol)
 
-        # 標記資料源
-        if source:
-            st.caption(f"📡 {source}")
-
-        df = add_indicators(df)
-        attack, ambush, dump = sniper_signal(df)
-        state_text, state_code = market_state(df)
-
-        # ========== 市場狀態 ==========
-        st.metric("市場狀態", state_text)
-
-        # ========== Grid 建議 ==========
-        grid_info = calculate_grid(symbol, df)
-        if grid_info:
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric(
-                    "下界",
-                    f"${grid_info['lower']:.2f}",
-                    delta=f"-{GRID_PARAMS[symbol]['lower_pct']:.1f}%"
-                )
-            with col2:
-                st.metric(
-                    "現價",
-                    f"${grid_info['current']:.2f}",
-                    delta=df.iloc[-1]["pct"]
-                )
-            with col3:
-                st.metric(
-                    "上界",
-                    f"${grid_info['upper']:.2f}",
-                    delta=f"+{GRID_PARAMS[symbol]['upper_pct']:.1f}%"
-                )
+    if df is None or len(df) < MIN_BARS:
+        st.warning(f"⏳ 等待 K 線資料 ({source or '所有源'})")
+        return
+
+    # 標記資料源
+    if source:
+        st.caption(f"📡 {source}")
+
+    state = add_indicators(df, source, st.session_state.symbol_states.get(symbol))
+    st.session_state.symbol_states[symbol] = state
+    attack, ambush, dump = sniper_signal(state)
+    state_text, state_code = market_state(state)
+
+    # ========== 市場狀態 ==========
+    st.metric("市場狀態", state_text)
+
+    # ========== Grid 建議 ==========
+    grid_info = calculate_grid(symbol, state)
+    if grid_info:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric(
+                "下界",
+                f"${grid_info.lower:.2f}",
+                delta=f"-{GRID_PARAMS[symbol]['lower_pct']:.1f}%"
+            )
+        with col2:
+            st.metric(
+                "現價",
+                f"${grid_info.current:.2f}",
+                delta=state.pct[-1]
+            )
+        with col3:
+            st.metric(
+                "上界",
+                f"${grid_info.upper:.2f}",
+                delta=f"+{GRID_PARAMS[symbol]['upper_pct']:.1f}%"
+            )
 
-            with st.expander("📋 Grid 詳細參數"):
-                st.write(f"""
+        with st.expander("📋 Grid 詳細參數"):
+            st.write(f"""
 **Grid 建議：**
-- 網格數量：{grid_info['grid_count']} 格
-- 單格寬度：${grid_info['grid_width']:.2f}
-- 24h ATR：{grid_info['atr_pct']:.2f}%
-                """)
-
-        # ========== Sniper 訊號 ==========
-        signal_cols = st.columns(3)
-        with signal_cols[0]:
-            if attack:
-                st.error("🔥 攻擊訊號")
-                key = f"{symbol}_attack_{datetime.now().strftime('%Y%m%d%H')}"
-                if key not in st.session_state.alert_log:
-                    grid_msg = ""
-                    if grid_info:
-                        grid_msg = f"""
-上界：${grid_info['upper']:.2f}
-下界：${grid_info['lower']:.2f}
+- 網格數量：{grid_info.grid_count} 格
+- 單格寬度：${grid_info.grid_width:.2f}
+- 24h ATR：{grid_info.atr_pct:.2f}%
+            """)
+
+    # ========== Sniper 訊號 ==========
+    signal_cols = st.columns(3)
+    with signal_cols[0]:
+        if attack:
+            st.error("🔥 攻擊訊號")
+            key = f"{symbol}_attack"
+            if key not in st.session_state.alert_log:
+                grid_msg = ""
+                if grid_info:
+                    grid_msg = f"""
+上界：${grid_info.upper:.2f}
+下界：${grid_info.lower:.2f}
 """
-                    send_telegram(
-                        f"🔥【攻擊】{symbol}\n"
-                        f"放量突破 + 價強\n"
-                        f"建議：收緊下界、偏多網格\n"
-                        f"{grid_msg}"
-                    )
-                    st.session_state.alert_log[key] = True
-            else:
-                st.empty()
-
-        with signal_cols[1]:
-            if ambush:
-                st.warning("💣 伏擊（爆量盤整）")
-                st.caption("主力吸籌，擴大網格")
-            else:
-                st.empty()
-
-        with signal_cols[2]:
-            if dump:
-                st.info("💀 出貨警告")
-                key = f"{symbol}_dump_{datetime.now().strftime('%Y%m%d%H')}"
+                send_telegram(
+                    f"🔥【攻擊】{symbol}\n"
+                    f"放量突破 + 價強\n"
+                    f"建議：收緊下界、偏多網格\n"
+                    f"{grid_msg}"
+                )
+                st.session_state.alert_log[key] = True
+        else:
+            st.empty()
+
+    with signal_cols[1]:
+        if ambush:
+            st.warning("💣 伏擊（爆量盤整）")
+            st.caption("主力吸籌，擴大網格")
+        else:
+            st.empty()
+
+    with signal_cols[2]:
+        if dump:
+            st.info("💀 出貨警告")
+            key = f"{symbol}_dump"
+            if key not in st.session_state.alert_log:
+                send_telegram(
+                    f"💀【出貨】{symbol}\n"
+                    f"跌破均線 + 爆量\n"
+                    f"建議：停網格或下移"
+                )
+                st.session_state.alert_log[key] = True
+
+    # ========== 風險雷達 ==========
+    risk = risk_radar(state, symbol)
+    if risk:
+        st.warning("⚠️ 風險警告")
+        for r in risk:
+            st.caption(r)
+            # 大風險 Telegram 提醒
+            if "急拉" in r or "急殺" in r:
+                key = f"{symbol}_risk_{datetime.now().strftime('%Y%m%d%H%M')}"
                 if key not in st.session_state.alert_log:
-                    send_telegram(
-                        f"💀【出貨】{symbol}\n"
-                        f"跌破均線 + 爆量\n"
-                        f"建議：停網格或下移"
-                    )
+                    send_telegram(f"⚠️【{symbol}】{r}")
                     st.session_state.alert_log[key] = True
 
-        # ========== 風險雷達 ==========
-        risk = risk_radar(df, symbol)
-        if risk:
-            st.warning("⚠️ 風險警告")
-            for r in risk:
-                st.caption(r)
-                # 大風險 Telegram 提醒
-                if "急拉" in r or "急殺" in r:
-                    key = f"{symbol}_risk_{datetime.now().strftime('%Y%m%d%H%M')}"
-                    if key not in st.session_state.alert_log:
-                        send_telegram(f"⚠️【{symbol}】{r}")
-                        st.session_state.alert_log[key] = True
-
-        # ========== K 線圖表 ==========
-        fig = go.Figure()
-        fig.add_trace(go.Candlestick(
-            x=df["open_time"],
-            open=df["open"],
-            high=df["high"],
-            low=df["low"],
-            close=df["close"],
-            name="Price"
-        ))
-        fig.add_trace(go.Scatter(
-            x=df["open_time"],
-            y=df["ma20"],
-            name="MA20",
-            line=dict(color="blue")
-        ))
-        fig.add_trace(go.Scatter(
-            x=df["open_time"],
-            y=df["ma60"],
-            name="MA60",
-            line=dict(color="orange")
-        ))
-
-        # 加上 Grid 參考線
-        if grid_info:
-            fig.add_hline(
-                y=grid_info["lower"],
-                line_dash="dash",
-                line_color="red",
-                annotation_text="下界",
-                annotation_position="right"
-            )
-            fig.add_hline(
-                y=grid_info["upper"],
-                line_dash="dash",
-                line_color="green",
-                annotation_text="上界",
-                annotation_position="right"
-            )
-
-        fig.update_layout(
-            height=400,
-            margin=dict(l=10, r=10, t=30, b=10),
-            xaxis_rangeslider_visible=False
+    # ========== K 線圖表 ==========
+    key = f"fig_{symbol}"
+    if key not in st.session_state:
+        st.session_state[key] = build_chart(symbol)
+    fig = st.session_state[key]
+
+    # 原地更新 trace 資料，不重建 Figure
+    price, ma20, ma60 = fig.data
+    price.update(
+        x=state.open_time,
+        open=state.open,
+        high=state.high,
+        low=state.low,
+        close=state.close
+    )
+    ma20.update(x=state.open_time, y=state.ma20)
+    ma60.update(x=state.open_time, y=state.ma60)
+
+    # 加上 Grid 參考線
+    fig.layout.shapes = ()
+    fig.layout.annotations = ()
+    if grid_info:
+        fig.add_hline(
+            y=grid_info.lower,
+            line_dash="dash",
+            line_color="red",
+            annotation_text="下界",
+            annotation_position="right"
         )
-        st.plotly_chart(fig, use_container_width=True)
+        fig.add_hline(
+            y=grid_info.upper,
+            line_dash="dash",
+            line_color="green",
+            annotation_text="上界",
+            annotation_position="right"
+        )
+
+    st.plotly_chart(fig, use_container_width=True, theme=None)
+
+
+# 主顯示區：只有此 fragment 定時重跑，Sidebar 與版面不重建
+@st.fragment(run_every=refresh_sec if auto_refresh else None)
+def render_dashboard():
+    stream = get_kline_stream()
+    stream.ensure(symbols)
+    klines = fetch_all(symbols, st.session_state.http, stream)
+    cols = st.columns(len(symbols))
+
+    for col, symbol in zip(cols, symbols):
+        with col:
+            render_symbol(symbol, *klines[symbol])
+
 
-if auto_refresh:
-    time.sleep(refresh_sec)
-    st.rerun()
+render_dashboard()